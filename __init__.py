@@ -3,12 +3,24 @@ RoonPipe Albert Plugin - Search and play Roon tracks via RoonPipe socket
 """
 
 import json
+import os
 import socket
+import threading
 import time
+from collections.abc import Callable, Iterator
+from functools import lru_cache, partial
 from pathlib import Path
+from types import ModuleType
+from typing import Any
 
 from albert import *
 
+orjson: ModuleType | None
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the standard library
+    orjson = None
+
 md_iid = '5.0'
 md_version = '1.0'
 md_name = 'RoonPipe'
@@ -19,59 +31,137 @@ md_authors = ['BlueManCZ']
 SOCKET_PATH = '/tmp/roonpipe.sock'
 PLUGIN_DIR = Path(__file__).parent
 ICON_PATH = Path(PLUGIN_DIR / 'icons' / 'roon.png')
+_ICON_PATH_STR = str(ICON_PATH)
+NOT_RUNNING = 'RoonPipe is not running'
+SOCKET_TIMEOUT = 5.0  # Seconds to wait for RoonPipe to respond
+RECV_BUFFER_SIZE = 8192  # Initial size of the response buffer in bytes
+CANCEL_POLL_MS = 50  # How often to check for a superseded query while waiting
+BATCH_SIZE = 16  # Number of items built per batch handed to Albert
+IMAGE_CACHE_TTL = 60  # Seconds to trust a cached album art existence check
+MIN_QUERY_LENGTH = 2  # Shorter queries are not sent to RoonPipe
+RESULTS_CACHE_TTL = 5.0  # Seconds to reuse the results of the previous query
 DEBOUNCE_MS = 200  # Debounce delay in milliseconds
+DEBOUNCE_POLL_MS = 20  # How often to re-check query validity while debouncing
+DEBOUNCE_MAX_WAIT_MS = None  # Optionally search at least this often while typing continues
+DEBOUNCE_LEADING = False  # Also search immediately on the first searchable keystroke of a burst
+
+
+def make_image_icon(image_path: str) -> Icon:
+    """Create a rounded icon from an image file."""
+    return Icon.iconified(Icon.image(image_path), border_radius=0.4, border_width=0)
 
 
-def make_roon_icon():
+def make_roon_icon() -> Icon:
     """Create the Roon icon from a local file."""
-    return Icon.iconified(Icon.image(ICON_PATH), border_radius=0.4, border_width=0)
+    return make_image_icon(_ICON_PATH_STR)
+
+
+@lru_cache(maxsize=128)
+def album_icon_factory(image_path: str) -> Callable[[], Icon]:
+    """Return an icon factory for album art, shared across searches."""
+    return partial(make_image_icon, image_path)
+
 
+if orjson is not None:
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+else:
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj).encode('utf-8')
 
-def send_command(command: dict) -> dict | None:
-    """Send a command to RoonPipe socket and return the response."""
+    _loads = json.loads
+
+
+def _connect() -> socket.socket:
+    """Connect to the RoonPipe socket, closing it again if the connection fails."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(SOCKET_TIMEOUT)
     try:
-        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        sock.settimeout(5.0)
         sock.connect(SOCKET_PATH)
-        sock.sendall(json.dumps(command).encode('utf-8'))
+    except OSError:
+        sock.close()
+        raise
+    return sock
 
-        response = b''
-        while True:
-            chunk = sock.recv(4096)
-            if not chunk:
-                break
-            response += chunk
 
-        sock.close()
-        return json.loads(response.decode('utf-8'))
+def send_command(command: dict[str, Any], is_valid: Callable[[], bool] | None = None) -> dict[str, Any] | None:
+    """Send a command to RoonPipe socket and return the response.
+
+    Args:
+        command: Command to send
+        is_valid: Optional check polled while waiting for the response;
+            the request is abandoned as soon as it returns False
+    """
+    try:
+        with _connect() as sock:
+            sock.sendall(_dumps(command))
+            if is_valid is not None:
+                sock.settimeout(CANCEL_POLL_MS / 1000)
+            deadline = time.monotonic() + SOCKET_TIMEOUT
+
+            # Receive into a growing buffer to avoid re-copying on every chunk
+            response = bytearray(RECV_BUFFER_SIZE)
+            view = memoryview(response)
+            size = 0
+            while True:
+                if size == len(response):
+                    view.release()
+                    response.extend(bytes(len(response)))
+                    view = memoryview(response)
+                try:
+                    received = sock.recv_into(view[size:])
+                except socket.timeout:
+                    if is_valid is None or time.monotonic() >= deadline:
+                        raise
+                    if not is_valid():
+                        return {'error': 'cancelled'}
+                    continue
+                if not received:
+                    break
+                size += received
+            view.release()
+
+        del response[size:]
+        return _loads(response)
     except socket.timeout:
         return {'error': 'timeout'}
+    except (FileNotFoundError, ConnectionRefusedError):
+        return {'error': 'not_running'}
     except socket.error:
         return {'error': 'connection'}
-    except json.JSONDecodeError:
+    except ValueError:  # JSON decode errors of both json and orjson
         return {'error': 'parse'}
 
 
-def search_tracks(query: str) -> tuple[list[dict], str | None]:
+def search_tracks(query: str, is_valid: Callable[[], bool] | None = None) -> tuple[list[dict[str, Any]], str | None, str | None]:
     """Search for tracks using RoonPipe.
 
+    Args:
+        query: Search query
+        is_valid: Optional check to abandon the search once it returns False
+
     Returns:
-        Tuple of (results list, error message / None)
+        Tuple of (results list, error message / None, error code / None)
     """
-    response = send_command({'command': 'search', 'query': query})
+    response = send_command({'command': 'search', 'query': query}, is_valid)
     if response is None:
-        return [], 'Connection failed'
-    if response.get('error') == 'timeout':
-        return [], 'Request timed out'
-    if response.get('error') == 'connection':
-        return [], 'Socket connection closed'
-    if response.get('error') == 'parse':
-        return [], 'Invalid response from RoonPipe'
-    if response.get('error'):
-        return [], str(response.get('error'))
+        return [], 'Connection failed', 'connection'
+    error = response.get('error')
+    if error == 'not_running':
+        return [], NOT_RUNNING, error
+    if error == 'timeout':
+        return [], 'Request timed out', error
+    if error == 'connection':
+        return [], 'Socket connection closed', error
+    if error == 'parse':
+        return [], 'Invalid response from RoonPipe', error
+    if error == 'cancelled':
+        return [], 'Search cancelled', error
+    if error:
+        return [], str(error), 'roonpipe'
     if response.get('results'):
-        return response['results'], None
-    return [], None
+        return response['results'], None, None
+    return [], None, None
 
 
 def play_item(item_key: str, session_key: str, category_key: str, item_index: int, action_title: str) -> bool:
@@ -95,102 +185,199 @@ def play_item(item_key: str, session_key: str, category_key: str, item_index: in
     return response is not None and response.get('success', False)
 
 
+@lru_cache(maxsize=32)
+def action_id(action_title: str) -> str:
+    """Create a unique action ID from an action title."""
+    return action_title.lower().replace(' ', '_')
+
+
+@lru_cache(maxsize=4096)
+def _image_exists(image_path: str, ttl_bucket: int) -> bool:
+    """Check whether album art exists; ttl_bucket only serves to expire cached answers."""
+    return bool(image_path) and os.path.exists(image_path)
+
+
+def image_exists(image_path: str) -> bool:
+    """Check whether album art exists, caching the answer for IMAGE_CACHE_TTL seconds."""
+    return _image_exists(image_path, int(time.monotonic() // IMAGE_CACHE_TTL))
+
+
+def status_item(item_id: str, text: str, subtext: str) -> StandardItem:
+    """Build an informational item shown instead of search results."""
+    return StandardItem(id=item_id, text=text, subtext=subtext, icon_factory=make_roon_icon)
+
+
+def build_item(index: int, result: dict[str, Any]) -> StandardItem:
+    """Build an Albert item from a single search result."""
+    title = result.get('title', 'Unknown')
+    subtitle = result.get('subtitle', '')
+    item_key = result.get('item_key', '')
+    session_key = result.get('sessionKey', '')
+    category_key = result.get('category_key', '')
+    item_index = result.get('index', 0)
+    item_type = result.get('type', 'track')
+    image_path = result.get('image', '')
+    actions_data = result.get('actions', [])
+
+    # Format: Type • subtitle
+    type_label = item_type.capitalize()
+    display_subtitle = f"{type_label} • {subtitle}" if subtitle else type_label
+
+    # Use album art if available, otherwise fallback to Roon icon
+    if image_exists(image_path):
+        icon_factory = album_icon_factory(image_path)
+    else:
+        icon_factory = make_roon_icon
+
+    # Build actions from API response
+    item_actions: list[Action] = []
+    for action in actions_data:
+        action_title = action.get('title', '')
+        if action_title:
+            item_actions.append(Action(
+                action_id(action_title),
+                action_title,
+                partial(play_item, item_key, session_key, category_key, item_index, action_title)
+            ))
+
+    return StandardItem(
+        id=f'roonpipe-{item_type}-{index}',
+        text=title,
+        subtext=display_subtitle,
+        icon_factory=icon_factory,
+        actions=item_actions
+    )
+
+
 class Plugin(PluginInstance, GeneratorQueryHandler):
 
-    def __init__(self):
+    def __init__(self) -> None:
         PluginInstance.__init__(self)
         GeneratorQueryHandler.__init__(self)
-
-    def defaultTrigger(self):
+        self._lock = threading.Lock()
+        self._last_keystroke = 0.0
+        self._burst_start = 0.0
+        self._burst_open = False
+        self._last_query = ''
+        self._last_results: list[dict[str, Any]] | None = None
+        self._last_results_time = 0.0
+
+    def _record_keystroke(self, searchable: bool) -> tuple[float, float]:
+        """Record a query change.
+
+        A typing burst starts with the first searchable query after a pause
+        or after queries too short to search.
+
+        Args:
+            searchable: Whether the query is long enough to be searched
+
+        Returns:
+            Tuple of (keystroke time, start time of the current typing burst)
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not searchable:
+                self._burst_open = False
+            elif not self._burst_open or now - self._last_keystroke >= DEBOUNCE_MS / 1000:
+                self._burst_start = now
+                self._burst_open = True
+            self._last_keystroke = now
+            return now, self._burst_start
+
+    def _debounce(self, ctx: QueryContext, now: float, burst_start: float) -> bool:
+        """Wait until typing pauses.
+
+        Args:
+            ctx: Albert query context
+            now: Time of the keystroke that produced this query
+            burst_start: Start time of the current typing burst
+
+        Returns:
+            True if the query should be searched, False if it was superseded
+        """
+        delay = DEBOUNCE_MS / 1000
+        if DEBOUNCE_LEADING and burst_start == now:
+            return ctx.isValid
+
+        # Trailing edge: bail out as soon as a newer keystroke invalidates us,
+        # but don't let continuous typing postpone the search past the max wait
+        deadline = now + delay
+        if DEBOUNCE_MAX_WAIT_MS is not None:
+            deadline = min(deadline, burst_start + DEBOUNCE_MAX_WAIT_MS / 1000)
+        while (remaining := deadline - time.monotonic()) > 0:
+            if not ctx.isValid:
+                return False
+            time.sleep(min(remaining, DEBOUNCE_POLL_MS / 1000))
+        if not ctx.isValid:
+            return False
+
+        # Keystrokes after this search start a new max wait period
+        with self._lock:
+            self._burst_start = time.monotonic()
+        return True
+
+    def _cached_results(self, query_string: str) -> list[dict[str, Any]] | None:
+        """Return the previous results if they were for the same query and are still fresh."""
+        with self._lock:
+            if (query_string == self._last_query and self._last_results is not None
+                    and time.monotonic() - self._last_results_time < RESULTS_CACHE_TTL):
+                return self._last_results
+        return None
+
+    def _cache_results(self, query_string: str, results: list[dict[str, Any]]) -> None:
+        """Remember the results of a successful search."""
+        with self._lock:
+            self._last_query = query_string
+            self._last_results = results
+            self._last_results_time = time.monotonic()
+
+    def defaultTrigger(self) -> str:
         return 'roon '
 
-    def synopsis(self, query):
+    def synopsis(self, query: str) -> str:
         return 'Search for tracks...'
 
-    def items(self, ctx):
+    def items(self, ctx: QueryContext) -> Iterator[list[Item]]:
         query_string = ctx.query.strip()
 
-        if not query_string:
-            return
+        # Record every keystroke, even ones not searched, so debouncing sees the whole burst
+        searchable = len(query_string) >= MIN_QUERY_LENGTH
+        now, burst_start = self._record_keystroke(searchable)
 
-        # Debounce: wait before searching to avoid spamming on every keystroke
-        time.sleep(DEBOUNCE_MS / 1000)
-        if not ctx.isValid:
+        if not searchable:
             return
 
-        # Check if socket exists
-        if not Path(SOCKET_PATH).exists():
-            yield [StandardItem(
-                id='roonpipe-not-running',
-                text='RoonPipe is not running',
-                subtext='Start RoonPipe daemon first: roonpipe',
-                icon_factory=make_roon_icon
-            )]
-            return
+        # Reuse the previous results when the same query is run again (e.g. a trailing space)
+        results = self._cached_results(query_string)
+        error = error_code = None
 
-        # Search for tracks
-        results, error = search_tracks(query_string)
+        if results is None:
+            # Debounce: wait for typing to pause to avoid spamming on every keystroke
+            if not self._debounce(ctx, now, burst_start):
+                return
+
+            # Search for tracks
+            results, error, error_code = search_tracks(query_string, lambda: ctx.isValid)
+            if not ctx.isValid:
+                return
+            if not error:
+                self._cache_results(query_string, results)
+
+        if error_code == 'not_running':
+            yield [status_item('roonpipe-not-running', NOT_RUNNING, 'Start RoonPipe daemon first: roonpipe')]
+            return
 
         if error:
-            yield [StandardItem(
-                id='roonpipe-error',
-                text=error,
-                subtext='Error occurred while searching Roon tracks',
-                icon_factory=make_roon_icon
-            )]
+            yield [status_item('roonpipe-error', error, 'Error occurred while searching Roon tracks')]
             return
 
         if not results:
-            yield [StandardItem(
-                id='roonpipe-no-results',
-                text='No tracks found',
-                subtext=f'No results for "{query_string}"',
-                icon_factory=make_roon_icon
-            )]
+            yield [status_item('roonpipe-no-results', 'No tracks found', f'No results for "{query_string}"')]
             return
 
-        items = []
-        for i, result in enumerate(results):
-            title = result.get('title', 'Unknown')
-            subtitle = result.get('subtitle', '')
-            item_key = result.get('item_key', '')
-            session_key = result.get('sessionKey', '')
-            category_key = result.get('category_key', '')
-            item_index = result.get('index', 0)
-            item_type = result.get('type', 'track')
-            image_path = result.get('image', '')
-            actions_data = result.get('actions', [])
-
-            # Format: Type • subtitle
-            type_label = item_type.capitalize()
-            display_subtitle = f"{type_label} • {subtitle}" if subtitle else type_label
-
-            # Use album art if available, otherwise fallback to Roon icon
-            if image_path and Path(image_path).exists():
-                icon_factory = lambda img=image_path: Icon.iconified(Icon.image(img), border_radius=0.4, border_width=0)
-            else:
-                icon_factory = make_roon_icon
-
-            # Build actions from API response
-            item_actions = []
-            for action in actions_data:
-                action_title = action.get('title', '')
-                if action_title:
-                    # Create a unique action ID from the title
-                    action_id = action_title.lower().replace(' ', '_')
-                    item_actions.append(Action(
-                        action_id,
-                        action_title,
-                        lambda ik=item_key, sk=session_key, ck=category_key, idx=item_index, at=action_title:
-                            play_item(ik, sk, ck, idx, at)
-                    ))
-
-            items.append(StandardItem(
-                id=f'roonpipe-{item_type}-{i}',
-                text=title,
-                subtext=display_subtitle,
-                icon_factory=icon_factory,
-                actions=item_actions
-            ))
-
-        yield items
+        # Build items lazily in batches; Albert pulls further batches only when needed
+        for start in range(0, len(results), BATCH_SIZE):
+            if not ctx.isValid:
+                return
+            batch = results[start:start + BATCH_SIZE]
+            yield [build_item(start + offset, result) for offset, result in enumerate(batch)]